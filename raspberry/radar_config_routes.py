@@ -12,6 +12,30 @@
 # ─────────────────────────────────────────────
 # import subprocess   ← já deve existir ou adicione
 # from pathlib import Path  ← já deve existir
+import re
+import fcntl
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+# Gravações do .env saem da thread da requisição (SD card pode levar centenas de ms).
+# O wpa_supplicant.conf continua síncrono: a resposta depende de ele estar gravado.
+_write_executor = ThreadPoolExecutor(max_workers=1)
+
+
+def _aguardar_gravacao(gravacao) -> bool:
+    """Espera a gravação do .env terminar; registra falha no log e retorna se deu certo."""
+    try:
+        gravacao.result()
+        return True
+    except Exception as e:
+        log.error(f"Erro ao gravar .env: {e}")
+        return False
+
+# Regex pré-compiladas (scan Wi-Fi e wpa_supplicant.conf)
+_ESSID_RE = re.compile(r'ESSID:"(.+?)"')
+_QUAL_RE  = re.compile(r'Quality=(\d+)/(\d+)')
+_BLOCK_RE = re.compile(r'network\s*=?\s*\{[^}]*\}')
+_SSID_RE  = re.compile(r'\bssid\s*=\s*"(.*?)"')
 
 # ─────────────────────────────────────────────
 #  PASTA DE TEMPLATES (ajuste o app Flask existente)
@@ -42,46 +66,56 @@ def pagina_config():
 #  ENDPOINTS PARA A PÁGINA WEB
 # ══════════════════════════════════════════════
 
+_env_cache = {"mtime": 0, "data": {}}
+
+
+def carregar_env(env_path: Path = Path("/etc/radar/.env")) -> dict:
+    """Lê o .env como dict; só relê o arquivo quando o mtime muda."""
+    try:
+        mtime = env_path.stat().st_mtime_ns
+    except OSError:
+        return {}
+    if mtime != _env_cache["mtime"]:
+        texto = env_path.read_text()
+        _env_cache["data"] = {
+            chave.strip(): valor.strip()
+            for linha in texto.splitlines()
+            if "=" in linha and not linha.lstrip().startswith("#")
+            for chave, _, valor in [linha.partition("=")]
+        }
+        _env_cache["mtime"] = mtime
+    return _env_cache["data"]
+
+
 @app.route("/api/config-local", methods=["GET"])
 @requer_token
 def api_config_local():
     """Retorna as configurações atuais do .env para a página web."""
-    env_path = Path("/etc/radar/.env")
-    config = {}
-    if env_path.exists():
-        for linha in env_path.read_text().splitlines():
-            linha = linha.strip()
-            if "=" in linha and not linha.startswith("#"):
-                chave, _, valor = linha.partition("=")
-                # Nunca retorna a senha do PostgreSQL
-                if chave.strip() not in ("PG_PASS",):
-                    config[chave.strip()] = valor.strip()
+    config = dict(carregar_env())
+    config.pop("PG_PASS", None)  # Nunca retorna a senha do PostgreSQL
     return jsonify(config)
 
 
+SIOCGIFADDR = 0x8915
+
+
+def _ip_interface(sock, nome: str) -> str:
+    """Retorna o IPv4 da interface via ioctl, sem executar o binário `ip`."""
+    try:
+        ifreq = struct.pack("256s", nome.encode()[:15])
+        return socket.inet_ntoa(fcntl.ioctl(sock.fileno(), SIOCGIFADDR, ifreq)[20:24])
+    except OSError:
+        return "—"  # interface inexistente ou sem IPv4
+
+
 @app.route("/api/network-info", methods=["GET"])
 def api_network_info():
     """Retorna IPs das interfaces Wi-Fi e Ethernet."""
-    import subprocess
     info = {"wifi": "—", "eth": "—"}
     try:
-        # wlan0 = Wi-Fi
-        r = subprocess.run(
-            ["ip", "-4", "addr", "show", "wlan0"],
-            capture_output=True, text=True
-        )
-        for line in r.stdout.splitlines():
-            if "inet " in line:
-                info["wifi"] = line.strip().split()[1].split("/")[0]
-
-        # eth0 = Ethernet
-        r = subprocess.run(
-            ["ip", "-4", "addr", "show", "eth0"],
-            capture_output=True, text=True
-        )
-        for line in r.stdout.splitlines():
-            if "inet " in line:
-                info["eth"] = line.strip().split()[1].split("/")[0]
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            info["wifi"] = _ip_interface(s, "wlan0")  # wlan0 = Wi-Fi
+            info["eth"] = _ip_interface(s, "eth0")    # eth0 = Ethernet
     except Exception as e:
         log.debug(f"network-info erro: {e}")
 
@@ -92,8 +126,9 @@ def api_network_info():
 @requer_token
 def api_wifi_scan():
     """Escaneia redes Wi-Fi disponíveis."""
-    import subprocess, re
+    import subprocess
     redes = []
+    vistos = set()
     try:
         # Força um scan
         subprocess.run(["sudo", "iwlist", "wlan0", "scan"], capture_output=True)
@@ -101,11 +136,12 @@ def api_wifi_scan():
             ["sudo", "iwlist", "wlan0", "scan"],
             capture_output=True, text=True, timeout=10
         )
-        ssids = re.findall(r'ESSID:"(.+?)"', r.stdout)
-        qualidades = re.findall(r'Quality=(\d+)/(\d+)', r.stdout)
+        ssids = _ESSID_RE.findall(r.stdout)
+        qualidades = _QUAL_RE.findall(r.stdout)
 
         for i, ssid in enumerate(ssids):
-            if ssid and ssid not in [n["ssid"] for n in redes]:
+            if ssid and ssid not in vistos:
+                vistos.add(ssid)
                 qual = qualidades[i] if i < len(qualidades) else (0, 70)
                 sinal = round((int(qual[0]) / int(qual[1])) * 4)
                 redes.append({"ssid": ssid, "signal": max(1, min(4, sinal))})
@@ -138,11 +174,7 @@ def api_wifi_configurar():
         conteudo_atual = ""
 
     # Remove bloco da mesma rede se já existir
-    import re
-    conteudo_atual = re.sub(
-        rf'network\s*\{{[^}}]*ssid\s*=\s*"{re.escape(ssid)}"[^}}]*\}}',
-        '', conteudo_atual, flags=re.DOTALL
-    ).strip()
+    conteudo_atual = _remover_rede_wpa(conteudo_atual, ssid)
 
     # Adiciona nova configuração
     if senha:
@@ -231,11 +263,13 @@ BLE_NAME=Radar-{novo_id}
 BLE_ENABLED=0
 """
     env_path.parent.mkdir(parents=True, exist_ok=True)
-    env_path.write_text(padrao)
+    gravacao = _write_executor.submit(escrever_env_atomico, env_path, padrao)
     log.warning(f"Reset de fábrica realizado por {request.remote_addr}")
 
     def _reiniciar():
         import time as _time
+        if not _aguardar_gravacao(gravacao):
+            return  # .env não foi gravado: reiniciar só voltaria com a config antiga
         _time.sleep(1)
         import os as _os
         _os.system("sudo systemctl restart radar_service")
@@ -243,7 +277,7 @@ BLE_ENABLED=0
     import threading as _threading
     _threading.Thread(target=_reiniciar, daemon=True).start()
 
-    return jsonify({"status": "ok", "mensagem": "Reset realizado. Reiniciando..."})
+    return jsonify({"status": "ok", "mensagem": "Reset em andamento. O serviço reinicia após gravar os padrões."})
 
 
 # ══════════════════════════════════════════════
@@ -288,8 +322,8 @@ def api_configurar_v2():
         f"BLE_ENABLED={dados.get('ble_enabled', '0')}",
     ]
 
-    env_path.write_text("\n".join(linhas) + "\n")
-    log.info(f"Configuração salva via página web por {request.remote_addr}")
+    gravacao = _write_executor.submit(escrever_env_atomico, env_path, "\n".join(linhas) + "\n")
+    log.info(f"Configuração recebida via página web de {request.remote_addr}")
 
     # Aplica Wi-Fi se fornecido
     if dados.get("wifi_ssid"):
@@ -303,6 +337,8 @@ def api_configurar_v2():
 
     # Reinicia serviço para aplicar
     def _reiniciar():
+        if not _aguardar_gravacao(gravacao):
+            return  # .env não foi gravado: reiniciar só voltaria com a config antiga
         import time as _t; _t.sleep(1)
         import os as _o; _o.system("sudo systemctl restart radar_service")
     import threading as _th
@@ -310,21 +346,30 @@ def api_configurar_v2():
 
     return jsonify({
         "status": "ok",
-        "mensagem": "Configurações salvas. Reiniciando serviço...",
+        "mensagem": "Configurações recebidas. O serviço reinicia após gravá-las.",
         "radar_id": RADAR_ID
     })
 
 
+def _remover_rede_wpa(conteudo: str, ssid: str) -> str:
+    """Remove do wpa_supplicant.conf os blocos network={...} do SSID (uma só passada)."""
+    partes = []
+    pos = 0
+    for bloco in _BLOCK_RE.finditer(conteudo):
+        m = _SSID_RE.search(bloco.group(0))
+        if m and m.group(1) == ssid:
+            partes.append(conteudo[pos:bloco.start()])
+            pos = bloco.end()
+    partes.append(conteudo[pos:])
+    return "".join(partes).strip()
+
+
 def _configurar_wifi(ssid: str, senha: str):
     """Função auxiliar para configurar Wi-Fi."""
-    import re
     wpa_path = Path("/etc/wpa_supplicant/wpa_supplicant.conf")
     conteudo = wpa_path.read_text() if wpa_path.exists() else "country=BR\nctrl_interface=DIR=/var/run/wpa_supplicant GROUP=netpie\nupdate_config=1\n"
 
-    conteudo = re.sub(
-        rf'network\s*\{{[^}}]*ssid\s*=\s*"{re.escape(ssid)}"[^}}]*\}}',
-        '', conteudo, flags=re.DOTALL
-    ).strip()
+    conteudo = _remover_rede_wpa(conteudo, ssid)
 
     if senha:
         bloco = f'\nnetwork={{\n    ssid="{ssid}"\n    psk="{senha}"\n    key_mgmt=WPA-PSK\n    priority=10\n}}\n'
@@ -19,15 +19,24 @@ import os
 import time
 import json
 import uuid
+import io
+import csv
+import hmac
+import atexit
 import logging
+import logging.handlers
+import queue
+import random
 import sqlite3
+import tempfile
 import threading
 import socket
-from datetime import datetime
+from collections import deque
+from itertools import islice
 from pathlib import Path
 
 # Flask e extras
-from flask import Flask, jsonify, request, abort
+from flask import Flask, Response, jsonify, request, abort
 from functools import wraps
 
 # GPIO (só disponível no Pi)
@@ -42,11 +51,20 @@ except ImportError:
 try:
     import psycopg2
     import psycopg2.extras
+    import psycopg2.pool
     PG_AVAILABLE = True
 except ImportError:
     PG_AVAILABLE = False
     print("[AVISO] psycopg2 não instalado - sync com PostgreSQL desabilitado")
 
+# Servidor WSGI de produção
+try:
+    from waitress import serve
+    WAITRESS_AVAILABLE = True
+except ImportError:
+    WAITRESS_AVAILABLE = False
+    print("[AVISO] waitress não instalado - usando servidor de desenvolvimento do Flask")
+
 # Dotenv
 try:
     from dotenv import load_dotenv
@@ -61,12 +79,14 @@ RADAR_ID       = os.getenv("RADAR_ID", str(uuid.uuid4())[:8])
 RADAR_NAME     = os.getenv("RADAR_NAME", socket.gethostname())
 RADAR_LOCATION = os.getenv("RADAR_LOCATION", "Não configurado")
 API_TOKEN      = os.getenv("API_TOKEN", "mude-este-token")
+_API_TOKEN_BYTES = API_TOKEN.encode()
 
 # GPIO
 SENSOR_A_PIN   = int(os.getenv("SENSOR_A_PIN", "17"))  # Sensor de entrada
 SENSOR_B_PIN   = int(os.getenv("SENSOR_B_PIN", "27"))  # Sensor de saída
 SENSOR_DIST_M  = float(os.getenv("SENSOR_DIST_M", "1.0"))  # Distância entre sensores em metros
 SPEED_LIMIT    = float(os.getenv("SPEED_LIMIT", "20.0"))    # Limite de velocidade km/h
+_KMH_K         = SENSOR_DIST_M * 3.6  # km/h = _KMH_K / Δt (s)
 
 # PostgreSQL Central
 PG_HOST        = os.getenv("PG_HOST", "")
@@ -78,6 +98,7 @@ PG_PASS        = os.getenv("PG_PASS", "")
 # SQLite local
 SQLITE_PATH    = os.getenv("SQLITE_PATH", "/var/lib/radar/radar_local.db")
 SYNC_INTERVAL  = int(os.getenv("SYNC_INTERVAL", "30"))  # segundos
+PG_CHECK_INTERVAL = 120  # segundos entre testes de conexão quando não há o que sincronizar
 
 # API
 API_PORT       = int(os.getenv("API_PORT", "5000"))
@@ -85,25 +106,75 @@ API_PORT       = int(os.getenv("API_PORT", "5000"))
 # ─────────────────────────────────────────────
 #  LOGGING
 # ─────────────────────────────────────────────
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler("/var/log/radar_service.log")
-    ]
-)
+# Quem loga só enfileira; a escrita no console/arquivo (SD card) fica
+# na thread do QueueListener, iniciada junto com a configuração para valer
+# também quando o módulo é servido por waitress-serve ou importado.
+_log_queue = queue.Queue(-1)
+_log_handlers = [
+    logging.StreamHandler(),
+    logging.FileHandler("/var/log/radar_service.log", delay=True)
+]
+for _h in _log_handlers:
+    _h.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(message)s"))
+_log_listener = logging.handlers.QueueListener(_log_queue, *_log_handlers)
+_log_listener.start()
+atexit.register(_log_listener.stop)  # descarrega a fila de log ao sair
+
+_log_queue_handler = logging.handlers.QueueHandler(_log_queue)
+_log_queue_handler.setFormatter(logging.Formatter("%(message)s"))
+logging.basicConfig(level=logging.INFO, handlers=[_log_queue_handler])
 log = logging.getLogger("RadarService")
 
+_iso_cache = (None, "")  # (segundo epoch, "YYYY-MM-DDTHH:MM:SS" local)
+
+
+def agora_iso() -> str:
+    """Hora local em ISO 8601 com milissegundos (formata a parte de segundos uma vez por segundo)."""
+    global _iso_cache
+    t = time.time()
+    seg = int(t)
+    cache_seg, prefixo = _iso_cache
+    if seg != cache_seg:
+        prefixo = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(seg))
+        _iso_cache = (seg, prefixo)
+    return f"{prefixo}.{int((t - seg) * 1000):03d}"
+
+
 # ─────────────────────────────────────────────
 #  BANCO DE DADOS LOCAL (SQLite)
 # ─────────────────────────────────────────────
+_DB = None                  # conexão persistente, aberta em init_sqlite()
+_DB_LOCK = threading.Lock()  # serializa o uso de _DB entre GPIO, sync e API
+
+# Contadores em memória para /api/status (evita COUNT(*) por requisição)
+_stats = {"total": 0, "pending": 0}
+_stats_lock = threading.Lock()
+
+_sync_evt = threading.Event()  # acorda loop_sincronizacao antes do intervalo
+SYNC_LOTE_MINIMO = 50          # pendentes que disparam sync imediato
+
+
+def _connect():
+    """Abre conexão SQLite com os PRAGMAs por conexão (WAL já persiste no arquivo)."""
+    conn = sqlite3.connect(SQLITE_PATH, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=5000")
+    return conn
+
+
 def init_sqlite():
-    """Cria tabelas no SQLite local."""
+    """Cria tabelas no SQLite local e abre a conexão persistente."""
+    global _DB
     Path(SQLITE_PATH).parent.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(SQLITE_PATH)
+    conn = _connect()
     c = conn.cursor()
 
+    # WAL: gravação é um append sequencial e leituras da API não bloqueiam o sensor
+    c.execute("PRAGMA journal_mode=WAL")
+    c.execute("PRAGMA temp_store=MEMORY")
+    c.execute("PRAGMA cache_size=-4000")
+
     c.execute("""
         CREATE TABLE IF NOT EXISTS deteccoes (
             id          INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -117,6 +188,12 @@ def init_sqlite():
         )
     """)
 
+    # Índice parcial: contém só as pendentes, a busca de sync vira range-scan
+    c.execute("""
+        CREATE INDEX IF NOT EXISTS idx_det_pending
+        ON deteccoes(sincronizado, id) WHERE sincronizado = 0
+    """)
+
     c.execute("""
         CREATE TABLE IF NOT EXISTS config (
             chave TEXT PRIMARY KEY,
@@ -134,25 +211,87 @@ def init_sqlite():
     """)
 
     conn.commit()
-    conn.close()
+    _DB = conn
+
+    total = c.execute("SELECT COUNT(*) FROM deteccoes").fetchone()[0]
+    pendentes = c.execute("SELECT COUNT(*) FROM deteccoes WHERE sincronizado = 0").fetchone()[0]
+    with _stats_lock:
+        _stats["total"] = total
+        _stats["pending"] = pendentes
     log.info(f"SQLite iniciado em: {SQLITE_PATH}")
 
 
+_DET_Q = queue.Queue(maxsize=1000)  # detecções aguardando gravação no SQLite
+
+
+def _inserir_deteccoes(itens: list):
+    """Grava um lote de detecções em uma única transação (desfaz tudo se falhar)."""
+    with _DB_LOCK:
+        try:
+            _DB.executemany("""
+                INSERT INTO deteccoes (uuid, radar_id, timestamp, velocidade, direcao, acima_limite)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, itens)
+            _DB.commit()
+        except Exception:
+            _DB.rollback()  # não deixa linhas do lote abertas para o próximo commit
+            raise
+    with _stats_lock:
+        _stats["total"] += len(itens)
+        _stats["pending"] += len(itens)
+        if _stats["pending"] >= SYNC_LOTE_MINIMO:
+            _sync_evt.set()  # acorda o sync antes do SYNC_INTERVAL
+
+
+def _gravar_lote(itens: list) -> list:
+    """Grava o lote sem propagar erros; retorna as detecções que ficaram por gravar.
+
+    Violação de integridade isola a linha ruim (gravando uma a uma) e descarta só ela;
+    outros erros (disco cheio, banco travado) devolvem o lote para nova tentativa.
+    """
+    try:
+        _inserir_deteccoes(itens)
+        return []
+    except sqlite3.IntegrityError as e:
+        if len(itens) == 1:
+            log.error(f"Detecção {itens[0][0]} descartada: {e}")
+            return []
+        restantes = []
+        for item in itens:
+            restantes += _gravar_lote([item])
+        return restantes
+    except Exception as e:
+        log.error(f"Erro ao gravar {len(itens)} detecções: {e}")
+        return itens
+
+
+def loop_gravacao_deteccoes():
+    """Thread que esvazia a fila de detecções gravando em lotes (1 commit por lote)."""
+    pendentes = []
+    while True:
+        itens = pendentes or [_DET_Q.get()]
+        while len(itens) < 200:
+            try:
+                itens.append(_DET_Q.get(timeout=0.2))
+            except queue.Empty:
+                break
+        pendentes = _gravar_lote(itens)
+        if pendentes:
+            time.sleep(1)  # erro transitório: tenta o mesmo lote de novo
+
+
 def salvar_deteccao(velocidade: float, direcao: str = "A->B"):
-    """Salva uma detecção no SQLite local."""
-    conn = sqlite3.connect(SQLITE_PATH)
-    c = conn.cursor()
+    """Enfileira uma detecção para gravação no SQLite local e retorna seu uuid."""
     uid = str(uuid.uuid4())
-    ts = datetime.now().isoformat()
+    ts = agora_iso()
     acima = 1 if velocidade > SPEED_LIMIT else 0
 
-    c.execute("""
-        INSERT INTO deteccoes (uuid, radar_id, timestamp, velocidade, direcao, acima_limite)
-        VALUES (?, ?, ?, ?, ?, ?)
-    """, (uid, RADAR_ID, ts, velocidade, direcao, acima))
-
-    conn.commit()
-    conn.close()
+    item = (uid, RADAR_ID, ts, velocidade, direcao, acima)
+    try:
+        _DET_Q.put_nowait(item)
+    except queue.Full:
+        # Gravador atrasado: grava direto para não perder a detecção
+        _gravar_lote([item])
 
     log.info(f"Detecção salva: {velocidade:.1f} km/h | Acima do limite: {'SIM' if acima else 'NÃO'}")
     return uid
@@ -160,43 +299,84 @@ def salvar_deteccao(velocidade: float, direcao: str = "A->B"):
 
 def get_deteccoes_nao_sincronizadas():
     """Retorna detecções ainda não enviadas ao PostgreSQL."""
-    conn = sqlite3.connect(SQLITE_PATH)
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    c.execute("SELECT * FROM deteccoes WHERE sincronizado = 0 ORDER BY id LIMIT 100")
-    rows = [dict(r) for r in c.fetchall()]
-    conn.close()
-    return rows
+    with _DB_LOCK:
+        c = _DB.execute("SELECT * FROM deteccoes WHERE sincronizado = 0 ORDER BY id LIMIT 5000")
+        return [dict(r) for r in c.fetchall()]
 
 
 def marcar_sincronizado(uuids: list):
     """Marca registros como sincronizados."""
-    conn = sqlite3.connect(SQLITE_PATH)
-    c = conn.cursor()
-    c.executemany("UPDATE deteccoes SET sincronizado = 1 WHERE uuid = ?", [(u,) for u in uuids])
-    conn.commit()
-    conn.close()
+    alterados = 0
+    with _DB_LOCK:
+        # Um UPDATE por bloco de 900 (limite padrão do SQLite: 999 parâmetros)
+        for i in range(0, len(uuids), 900):
+            bloco = uuids[i:i + 900]
+            marcadores = ",".join("?" * len(bloco))
+            c = _DB.execute(
+                f"UPDATE deteccoes SET sincronizado = 1 WHERE uuid IN ({marcadores}) AND sincronizado = 0",
+                bloco
+            )
+            alterados += c.rowcount
+        _DB.commit()
+    with _stats_lock:
+        _stats["pending"] -= alterados
 
 
 # ─────────────────────────────────────────────
 #  SINCRONIZAÇÃO COM POSTGRESQL CENTRAL
 # ─────────────────────────────────────────────
+_PG_POOL = None
+_pg_pool_lock = threading.Lock()
+_pg_conectado = False  # último resultado do teste de conexão (usado em /api/status)
+_pg_schema_ready = False  # garantir_tabela_pg já rodou nesta execução
+
+
 def get_pg_connection():
-    """Cria conexão com o PostgreSQL central."""
+    """Empresta uma conexão do pool do PostgreSQL central (devolver com release_pg)."""
+    global _PG_POOL
     if not PG_AVAILABLE or not PG_HOST:
         return None
     try:
-        conn = psycopg2.connect(
-            host=PG_HOST, port=PG_PORT,
-            dbname=PG_DB, user=PG_USER, password=PG_PASS,
-            connect_timeout=5
-        )
-        return conn
+        with _pg_pool_lock:
+            if _PG_POOL is None:
+                _PG_POOL = psycopg2.pool.ThreadedConnectionPool(
+                    1, 4,
+                    host=PG_HOST, port=PG_PORT,
+                    dbname=PG_DB, user=PG_USER, password=PG_PASS,
+                    connect_timeout=5
+                )
+        return _PG_POOL.getconn()
     except Exception as e:
         log.warning(f"Falha ao conectar PostgreSQL: {e}")
         return None
 
 
+def release_pg(conn):
+    """Devolve a conexão ao pool; conexões quebradas são descartadas."""
+    try:
+        if not conn.closed:
+            conn.rollback()
+        _PG_POOL.putconn(conn, close=bool(conn.closed))
+    except Exception as e:
+        log.debug(f"Erro ao devolver conexão PostgreSQL: {e}")
+
+
+def verificar_pg():
+    """Testa o PostgreSQL com uma conexão do pool e guarda o resultado."""
+    global _pg_conectado
+    pg = get_pg_connection()
+    if not pg:
+        _pg_conectado = False
+        return
+    try:
+        pg.cursor().execute("SELECT 1")
+        _pg_conectado = True
+    except Exception:
+        _pg_conectado = False
+    finally:
+        release_pg(pg)
+
+
 def garantir_tabela_pg(pg_conn):
     """Cria tabela no PostgreSQL se não existir."""
     c = pg_conn.cursor()
@@ -216,122 +396,191 @@ def garantir_tabela_pg(pg_conn):
     pg_conn.commit()
 
 
-def sincronizar_com_central():
-    """Envia detecções pendentes para o PostgreSQL central."""
+COPY_MIN_ROWS = 1000  # acima disso o sync usa COPY em vez de INSERT ... VALUES
+
+
+def _copiar_para_central(cursor, rows: list) -> int:
+    """Envia as linhas com COPY para uma tabela temporária e insere no central.
+
+    Tudo roda na transação corrente; retorna quantas linhas eram novas.
+    """
+    cursor.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS radar_deteccoes_stage (
+            uuid TEXT, radar_id TEXT, radar_nome TEXT, timestamp TIMESTAMPTZ,
+            velocidade NUMERIC(6,2), direcao TEXT, acima_limite BOOLEAN
+        ) ON COMMIT DELETE ROWS
+    """)
+    buf = io.StringIO()
+    csv.writer(buf).writerows(rows)
+    buf.seek(0)
+    cursor.copy_expert(
+        "COPY radar_deteccoes_stage "
+        "(uuid, radar_id, radar_nome, timestamp, velocidade, direcao, acima_limite) "
+        "FROM STDIN WITH CSV",
+        buf
+    )
+    cursor.execute("""
+        INSERT INTO radar_deteccoes
+            (uuid, radar_id, radar_nome, timestamp, velocidade, direcao, acima_limite)
+        SELECT uuid, radar_id, radar_nome, timestamp, velocidade, direcao, acima_limite
+        FROM radar_deteccoes_stage
+        ON CONFLICT (uuid) DO NOTHING
+    """)
+    return cursor.rowcount
+
+
+def sincronizar_com_central() -> bool:
+    """Envia detecções pendentes para o PostgreSQL central.
+
+    Retorna False se o PostgreSQL estava indisponível ou o envio falhou.
+    """
+    global _pg_schema_ready, _pg_conectado
+    with _stats_lock:
+        if _stats["pending"] == 0:
+            return True  # nada a enviar: nem consulta o SQLite
     pendentes = get_deteccoes_nao_sincronizadas()
     if not pendentes:
-        return
+        return True
 
     pg = get_pg_connection()
     if not pg:
+        _pg_conectado = False
         log.debug("PostgreSQL indisponível, tentando depois...")
-        return
+        return False
 
     try:
-        garantir_tabela_pg(pg)
+        if not _pg_schema_ready:
+            garantir_tabela_pg(pg)
+            _pg_schema_ready = True
         c = pg.cursor()
-        enviados = []
-
-        for det in pendentes:
-            try:
-                c.execute("""
-                    INSERT INTO radar_deteccoes
-                        (uuid, radar_id, radar_nome, timestamp, velocidade, direcao, acima_limite)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s)
-                    ON CONFLICT (uuid) DO NOTHING
-                """, (
-                    det["uuid"], det["radar_id"], RADAR_NAME,
-                    det["timestamp"], det["velocidade"],
-                    det["direcao"], bool(det["acima_limite"])
-                ))
-                enviados.append(det["uuid"])
-            except Exception as e:
-                log.error(f"Erro ao inserir detecção {det['uuid']}: {e}")
+        rows = [
+            (d["uuid"], d["radar_id"], RADAR_NAME, d["timestamp"],
+             d["velocidade"], d["direcao"], bool(d["acima_limite"]))
+            for d in pendentes
+        ]
+
+        if len(rows) > COPY_MIN_ROWS:
+            # Backfill grande (radar ficou offline): COPY via tabela temporária
+            inseridos = _copiar_para_central(c, rows)
+        else:
+            # Um único INSERT multi-linha em vez de um round-trip por detecção
+            inseridos = len(psycopg2.extras.execute_values(c, """
+                INSERT INTO radar_deteccoes
+                    (uuid, radar_id, radar_nome, timestamp, velocidade, direcao, acima_limite)
+                VALUES %s
+                ON CONFLICT (uuid) DO NOTHING
+                RETURNING uuid
+            """, rows, page_size=1000, fetch=True))
 
         pg.commit()
-        pg.close()
+        release_pg(pg)
+        _pg_conectado = True
 
-        if enviados:
-            marcar_sincronizado(enviados)
-            log.info(f"Sincronizados {len(enviados)} registros com PostgreSQL central")
+        # Conflitos já estão no central: todos os pendentes enviados ficam sincronizados
+        enviados = [d["uuid"] for d in pendentes]
+        marcar_sincronizado(enviados)
+        log.info(f"Sincronizados {len(enviados)} registros com PostgreSQL central "
+                 f"({inseridos} novos)")
+        return True
 
     except Exception as e:
         log.error(f"Erro na sincronização: {e}")
-        pg.close()
+        _pg_conectado = False     # conexão do pool pode estar morta (getconn não testa)
+        _pg_schema_ready = False  # após reconexão, confere a tabela de novo
+        release_pg(pg)
+        return False
 
 
 def loop_sincronizacao():
-    """Thread que sincroniza periodicamente."""
+    """Thread que sincroniza a cada SYNC_INTERVAL ou assim que acumulam pendentes."""
+    espera_erro = SYNC_INTERVAL
+    proximo_teste_pg = 0.0
+    _sync_evt.set()  # primeira sincronização logo ao iniciar
     while True:
+        _sync_evt.wait(SYNC_INTERVAL)
+        _sync_evt.clear()
         try:
-            sincronizar_com_central()
+            ok = sincronizar_com_central()
+            # O envio já atualiza _pg_conectado; o SELECT 1 só roda no próprio timer
+            if time.monotonic() >= proximo_teste_pg:
+                verificar_pg()
+                proximo_teste_pg = time.monotonic() + PG_CHECK_INTERVAL
         except Exception as e:
             log.error(f"Erro no loop de sync: {e}")
-        time.sleep(SYNC_INTERVAL)
+            ok = False
+
+        if ok:
+            espera_erro = SYNC_INTERVAL
+            with _stats_lock:
+                if _stats["pending"] >= SYNC_LOTE_MINIMO:
+                    _sync_evt.set()  # ainda há lote cheio: continua sem esperar
+        else:
+            # Backoff exponencial: não insiste em um PostgreSQL fora do ar
+            time.sleep(espera_erro)
+            espera_erro = min(espera_erro * 2, 600)
 
 
 # ─────────────────────────────────────────────
 #  LEITURA DE SENSORES IR (GPIO)
 # ─────────────────────────────────────────────
-sensor_a_tempo = None  # Timestamp quando sensor A detectou
-sensor_lock = threading.Lock()
+sensor_a_tempo = None  # time.monotonic_ns() de quando o sensor A detectou
 
 # Buffer para envio em tempo real via SSE
-eventos_realtime = []
+eventos_realtime = deque(maxlen=50)  # pares (versão, evento); máximo 50 no buffer
+eventos_versao = 0     # incrementado a cada evento; exposto em /api/status
 eventos_lock = threading.Lock()
 
 
 def adicionar_evento_realtime(dados: dict):
     """Adiciona evento ao buffer de tempo real."""
+    global eventos_versao
     with eventos_lock:
-        eventos_realtime.append(dados)
-        if len(eventos_realtime) > 50:  # máximo 50 eventos no buffer
-            eventos_realtime.pop(0)
+        eventos_versao += 1
+        eventos_realtime.append((eventos_versao, dados))
 
 
 def callback_sensor_a(channel):
     """Callback quando sensor A detecta objeto."""
     global sensor_a_tempo
-    with sensor_lock:
-        sensor_a_tempo = time.time()
-        log.debug(f"Sensor A ativado (GPIO {SENSOR_A_PIN})")
+    # Atribuição simples é atômica sob o GIL: dispensa lock
+    sensor_a_tempo = time.monotonic_ns()
+    log.debug(f"Sensor A ativado (GPIO {SENSOR_A_PIN})")
 
 
 def callback_sensor_b(channel):
     """Callback quando sensor B detecta objeto — calcula velocidade."""
     global sensor_a_tempo
-    with sensor_lock:
-        if sensor_a_tempo is None:
-            log.debug("Sensor B ativado mas A não registrou antes — ignorando")
-            return
-
-        delta_t = time.time() - sensor_a_tempo
-        sensor_a_tempo = None
+    t0 = sensor_a_tempo
+    if t0 is None:
+        log.debug("Sensor B ativado mas A não registrou antes — ignorando")
+        return
+    sensor_a_tempo = None
 
-        if delta_t <= 0 or delta_t > 10:  # ignora medições inválidas (>10s = irrelevante)
-            return
+    dt_ns = time.monotonic_ns() - t0
+    if dt_ns <= 0 or dt_ns > 10_000_000_000:  # ignora medições inválidas (>10s = irrelevante)
+        return
+    delta_t = dt_ns * 1e-9
 
-        # Velocidade = distância / tempo, convertendo para km/h
-        velocidade_ms = SENSOR_DIST_M / delta_t
-        velocidade_kmh = velocidade_ms * 3.6
+    # Velocidade = distância / tempo, já convertida para km/h
+    velocidade_kmh = _KMH_K / delta_t
 
-        if velocidade_kmh > 200:  # ignora leituras absurdas
-            return
+    if velocidade_kmh > 200:  # ignora leituras absurdas
+        return
 
-        log.info(f"Velocidade calculada: {velocidade_kmh:.2f} km/h (Δt={delta_t:.3f}s)")
-        uid = salvar_deteccao(velocidade_kmh, "A->B")
+    log.info(f"Velocidade calculada: {velocidade_kmh:.2f} km/h (Δt={delta_t:.3f}s)")
+    uid = salvar_deteccao(velocidade_kmh, "A->B")
 
-        evento = {
-            "uuid": uid,
-            "radar_id": RADAR_ID,
-            "radar_nome": RADAR_NAME,
-            "velocidade": round(velocidade_kmh, 2),
-            "limite": SPEED_LIMIT,
-            "acima_limite": velocidade_kmh > SPEED_LIMIT,
-            "timestamp": datetime.now().isoformat(),
-            "direcao": "A->B"
-        }
-        adicionar_evento_realtime(evento)
+    evento = {
+        "uuid": uid,
+        "radar_id": RADAR_ID,
+        "radar_nome": RADAR_NAME,
+        "velocidade": round(velocidade_kmh, 2),
+        "limite": SPEED_LIMIT,
+        "acima_limite": velocidade_kmh > SPEED_LIMIT,
+        "timestamp": agora_iso(),
+        "direcao": "A->B"
+    }
+    adicionar_evento_realtime(evento)
 
 
 def iniciar_gpio():
@@ -353,7 +602,6 @@ def iniciar_gpio():
 
 def simular_deteccoes():
     """Simula detecções para testes sem hardware."""
-    import random
     log.info("Modo simulação ativo — gerando detecções aleatórias")
     time.sleep(5)
     while True:
@@ -366,7 +614,7 @@ def simular_deteccoes():
             "velocidade": round(velocidade, 2),
             "limite": SPEED_LIMIT,
             "acima_limite": velocidade > SPEED_LIMIT,
-            "timestamp": datetime.now().isoformat(),
+            "timestamp": agora_iso(),
             "direcao": "A->B"
         }
         adicionar_evento_realtime(evento)
@@ -384,7 +632,8 @@ def requer_token(f):
     @wraps(f)
     def decorado(*args, **kwargs):
         auth = request.headers.get("Authorization", "")
-        if not auth.startswith("Bearer ") or auth[7:] != API_TOKEN:
+        # compare_digest: comparação em tempo constante (não vaza o token por timing)
+        if not auth.startswith("Bearer ") or not hmac.compare_digest(auth[7:].encode(), _API_TOKEN_BYTES):
             abort(401)
         return f(*args, **kwargs)
     return decorado
@@ -394,17 +643,12 @@ def requer_token(f):
 @requer_token
 def api_status():
     """Retorna status atual do radar."""
-    conn = sqlite3.connect(SQLITE_PATH)
-    c = conn.cursor()
-    c.execute("SELECT COUNT(*) FROM deteccoes")
-    total = c.fetchone()[0]
-    c.execute("SELECT COUNT(*) FROM deteccoes WHERE sincronizado = 0")
-    pendentes = c.fetchone()[0]
-    c.execute("SELECT velocidade, timestamp FROM deteccoes ORDER BY id DESC LIMIT 1")
-    ultima = c.fetchone()
-    conn.close()
-
-    pg_ok = get_pg_connection() is not None
+    with _stats_lock:
+        total = _stats["total"]
+        pendentes = _stats["pending"]
+    with _DB_LOCK:
+        c = _DB.execute("SELECT velocidade, timestamp FROM deteccoes ORDER BY id DESC LIMIT 1")
+        ultima = c.fetchone()
 
     return jsonify({
         "radar_id": RADAR_ID,
@@ -413,13 +657,14 @@ def api_status():
         "limite_velocidade": SPEED_LIMIT,
         "total_deteccoes": total,
         "pendentes_sync": pendentes,
-        "postgresql_conectado": pg_ok,
+        "postgresql_conectado": _pg_conectado,
         "gpio_ativo": GPIO_AVAILABLE,
+        "events_version": eventos_versao,
         "ultima_deteccao": {
             "velocidade": ultima[0] if ultima else None,
             "timestamp": ultima[1] if ultima else None
         } if ultima else None,
-        "timestamp": datetime.now().isoformat()
+        "timestamp": agora_iso()
     })
 
 
@@ -430,28 +675,86 @@ def api_deteccoes():
     limite = int(request.args.get("limite", 50))
     offset = int(request.args.get("offset", 0))
 
-    conn = sqlite3.connect(SQLITE_PATH)
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    c.execute("""
-        SELECT * FROM deteccoes
-        ORDER BY id DESC
-        LIMIT ? OFFSET ?
-    """, (limite, offset))
-    rows = [dict(r) for r in c.fetchall()]
-    conn.close()
-    return jsonify(rows)
+    def gerar():
+        # Conexão própria: em WAL a leitura não bloqueia o gravador nem usa _DB_LOCK
+        conn = _connect()
+        try:
+            c = conn.execute("""
+                SELECT * FROM deteccoes
+                ORDER BY id DESC
+                LIMIT ? OFFSET ?
+            """, (limite, offset))
+            yield "["
+            primeiro = True
+            for r in c:
+                yield ("" if primeiro else ",") + json.dumps(dict(r))
+                primeiro = False
+            yield "]"
+        finally:
+            conn.close()
+
+    return Response(gerar(), mimetype="application/json")
 
 
 @app.route("/api/eventos", methods=["GET"])
 @requer_token
 def api_eventos():
-    """Retorna eventos recentes para o dashboard em tempo real."""
+    """Retorna eventos recentes para o dashboard em tempo real.
+
+    ?since=N devolve apenas eventos com versão maior que N (ver events_version em /api/status).
+    """
+    since = request.args.get("since", 0, type=int)
     with eventos_lock:
-        dados = list(reversed(eventos_realtime[-20:]))
+        dados = [ev for versao, ev in islice(reversed(eventos_realtime), 20) if versao > since]
     return jsonify(dados)
 
 
+_ENV_TEMPLATE = """\
+RADAR_ID={radar_id}
+RADAR_NAME={radar_name}
+RADAR_LOCATION={radar_location}
+API_TOKEN={api_token}
+SENSOR_A_PIN={sensor_a_pin}
+SENSOR_B_PIN={sensor_b_pin}
+SENSOR_DIST_M={sensor_dist_m}
+SPEED_LIMIT={speed_limit}
+PG_HOST={pg_host}
+PG_PORT={pg_port}
+PG_DB={pg_db}
+PG_USER={pg_user}
+PG_PASS={pg_pass}
+SQLITE_PATH={sqlite_path}
+SYNC_INTERVAL={sync_interval}
+API_PORT={api_port}
+"""
+
+
+def escrever_env_atomico(env_path: Path, conteudo: str):
+    """Grava o .env em arquivo temporário e troca com os.replace (nunca fica pela metade).
+
+    O temporário é único por chamada (escritas concorrentes não se misturam) e herda
+    as permissões do .env atual, ou 0600 se ele ainda não existir (guarda token e senha).
+    """
+    try:
+        modo = env_path.stat().st_mode & 0o777
+    except FileNotFoundError:
+        modo = 0o600
+    fd, tmp = tempfile.mkstemp(dir=env_path.parent, prefix=env_path.name + ".")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(conteudo)
+            f.flush()
+            os.fchmod(f.fileno(), modo)
+            os.fsync(f.fileno())
+        os.replace(tmp, env_path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
 @app.route("/api/configurar", methods=["POST"])
 @requer_token
 def api_configurar():
@@ -474,26 +777,25 @@ def api_configurar():
     env_path = Path("/etc/radar/.env")
     env_path.parent.mkdir(parents=True, exist_ok=True)
 
-    linhas = [
-        f"RADAR_ID={RADAR_ID}",
-        f"RADAR_NAME={dados.get('radar_name', RADAR_NAME)}",
-        f"RADAR_LOCATION={dados.get('radar_location', RADAR_LOCATION)}",
-        f"API_TOKEN={dados.get('api_token', API_TOKEN)}",
-        f"SENSOR_A_PIN={dados.get('sensor_a_pin', SENSOR_A_PIN)}",
-        f"SENSOR_B_PIN={dados.get('sensor_b_pin', SENSOR_B_PIN)}",
-        f"SENSOR_DIST_M={dados.get('sensor_dist_m', SENSOR_DIST_M)}",
-        f"SPEED_LIMIT={dados.get('speed_limit', SPEED_LIMIT)}",
-        f"PG_HOST={dados.get('pg_host', PG_HOST)}",
-        f"PG_PORT={dados.get('pg_port', PG_PORT)}",
-        f"PG_DB={dados.get('pg_db', PG_DB)}",
-        f"PG_USER={dados.get('pg_user', PG_USER)}",
-        f"PG_PASS={dados.get('pg_pass', PG_PASS)}",
-        f"SQLITE_PATH={SQLITE_PATH}",
-        f"SYNC_INTERVAL={dados.get('sync_interval', SYNC_INTERVAL)}",
-        f"API_PORT={API_PORT}",
-    ]
-
-    env_path.write_text("\n".join(linhas) + "\n")
+    conteudo = _ENV_TEMPLATE.format(
+        radar_id=RADAR_ID,
+        radar_name=dados.get("radar_name", RADAR_NAME),
+        radar_location=dados.get("radar_location", RADAR_LOCATION),
+        api_token=dados.get("api_token", API_TOKEN),
+        sensor_a_pin=dados.get("sensor_a_pin", SENSOR_A_PIN),
+        sensor_b_pin=dados.get("sensor_b_pin", SENSOR_B_PIN),
+        sensor_dist_m=dados.get("sensor_dist_m", SENSOR_DIST_M),
+        speed_limit=dados.get("speed_limit", SPEED_LIMIT),
+        pg_host=dados.get("pg_host", PG_HOST),
+        pg_port=dados.get("pg_port", PG_PORT),
+        pg_db=dados.get("pg_db", PG_DB),
+        pg_user=dados.get("pg_user", PG_USER),
+        pg_pass=dados.get("pg_pass", PG_PASS),
+        sqlite_path=SQLITE_PATH,
+        sync_interval=dados.get("sync_interval", SYNC_INTERVAL),
+        api_port=API_PORT,
+    )
+    escrever_env_atomico(env_path, conteudo)
     log.info(f"Configuração atualizada via Manager por {request.remote_addr}")
 
     return jsonify({
@@ -537,6 +839,9 @@ if __name__ == "__main__":
     # Inicializa banco local
     init_sqlite()
 
+    # Inicia gravação das detecções em lote
+    threading.Thread(target=loop_gravacao_deteccoes, daemon=True).start()
+
     # Inicia GPIO / simulação
     iniciar_gpio()
 
@@ -546,4 +851,8 @@ if __name__ == "__main__":
 
     # Inicia API Flask
     log.info(f"API REST disponível em http://0.0.0.0:{API_PORT}")
-    app.run(host="0.0.0.0", port=API_PORT, debug=False, threaded=True)
+    if WAITRESS_AVAILABLE and not os.getenv("RADAR_DEV"):
+        serve(app, host="0.0.0.0", port=API_PORT, threads=4,
+              connection_limit=64, channel_timeout=30)
+    else:
+        app.run(host="0.0.0.0", port=API_PORT, debug=False, threaded=True)
@@ -41,7 +41,7 @@ cp radar_service.py /opt/radar_service/
 chown -R pi:pi /opt/radar_service /var/lib/radar /etc/radar
 
 echo -e "${YELLOW}[5/7] Instalando dependências Python...${NC}"
-pip3 install flask psycopg2-binary RPi.GPIO python-dotenv --break-system-packages --quiet
+pip3 install flask waitress psycopg2-binary RPi.GPIO python-dotenv --break-system-packages --quiet
 
 # Cria .env padrão se não existir
 if [ ! -f /etc/radar/.env ]; then
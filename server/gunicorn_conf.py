@@ -0,0 +1,30 @@
+"""
+=============================================================
+  GUNICORN_CONF.PY — Manager em produção (Linux)
+=============================================================
+  Executar:  gunicorn -c gunicorn_conf.py manager_server:app
+  (No Windows continue usando: python manager_server.py)
+=============================================================
+"""
+
+bind = "0.0.0.0:8080"
+
+# Um único worker: status dos radares, buffer de eventos e streams SSE
+# vivem em memória no processo. Vários workers dividiriam esse estado
+# (e duplicariam o polling). A concorrência vem das threads.
+#
+# Cada dashboard aberto prende uma thread em /api/stream (SSE) enquanto
+# estiver aberto; as demais chamadas /api/* dividem o que sobrar. Com 64
+# threads cabem dezenas de painéis/abas e ainda ~16 threads livres para a
+# API. Se houver mais telas que isso, aumente (threads são baratas aqui:
+# quase todas ficam paradas esperando evento).
+worker_class = "gthread"
+workers = 1
+threads = 64
+keepalive = 5
+
+
+def post_worker_init(worker):
+    """Inicia polling e demais threads de background dentro do worker."""
+    import manager_server
+    manager_server.iniciar_background()
@@ -10,28 +10,43 @@
   - Visualização do PostgreSQL central
   - Interface web acessível no navegador
 =============================================================
-  Instalar: pip install flask requests psycopg2-binary
+  Instalar: pip install flask requests aiohttp orjson psycopg2-binary
   Executar:  python manager_server.py
+             (Linux: gunicorn -c gunicorn_conf.py manager_server:app)
   Acessar:   http://localhost:8080
 =============================================================
 """
 
 import os
 import json
+import atexit
 import socket
+import asyncio
 import threading
 import time
 import ipaddress
+import queue
 import subprocess
+from collections import deque, OrderedDict
+from contextlib import contextmanager
+from itertools import islice, takewhile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FuturesTimeout
 from datetime import datetime, timedelta
+from functools import wraps
 from pathlib import Path
 
+import aiohttp
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
 from flask import Flask, render_template, jsonify, request, Response
+from flask.json.provider import DefaultJSONProvider
 
 try:
     import psycopg2
     import psycopg2.extras
+    import psycopg2.pool
     PG_AVAILABLE = True
 except ImportError:
     PG_AVAILABLE = False
@@ -43,6 +58,8 @@ CONFIG_FILE = Path("manager_config.json")
 MANAGER_PORT = 8080
 RADAR_API_PORT = 5000
 SCAN_TIMEOUT = 1.5  # segundos por host no scan
+SCAN_CONCORRENCIA = 100  # máximo de hosts consultados ao mesmo tempo no scan
+CONFIG_WORKERS = 32  # envios simultâneos na configuração em massa
 
 # Carrega/cria configuração persistente
 def carregar_config():
@@ -66,230 +83,460 @@ def carregar_config():
     return default
 
 def salvar_config(cfg: dict):
-    CONFIG_FILE.write_text(json.dumps(cfg, indent=2, ensure_ascii=False))
+    with _config_lock:
+        texto = json.dumps(cfg, indent=2, ensure_ascii=False)
+    CONFIG_FILE.write_text(texto)
+
+
+def salvar_config_debounced():
+    """Marca a config como alterada; a gravação em disco fica com loop_gravacao_config."""
+    global config_versao
+    with _config_lock:
+        config_versao += 1
+        _atualizar_config_publica()
+    _config_dirty.set()
+
+
+def _atualizar_config_publica():
+    """Recria a cópia da config servida em GET /api/config (sem a senha do PG).
+
+    Publica o par (versão, payload) numa única atribuição: quem lê nunca
+    combina o payload antigo com o ETag da versão nova.
+    """
+    global _config_public
+    with _config_lock:
+        _config_public = (config_versao, {k: v for k, v in config.items() if k != "pg_pass"})
+
+
+def loop_gravacao_config():
+    """Grava a config em disco no máximo a cada 500 ms, agrupando alterações."""
+    while True:
+        _config_dirty.wait()
+        time.sleep(0.5)
+        _config_dirty.clear()
+        try:
+            salvar_config(config)
+        except Exception:
+            pass
+
+
+def _gravar_pendente():
+    if _config_dirty.is_set():
+        salvar_config(config)
+
 
 config = carregar_config()
+config_versao = 0                  # incrementado a cada alteração da config
+_config_lock = threading.RLock()   # protege mutações de config
+_config_dirty = threading.Event()  # há alterações ainda não gravadas
+_config_etag_base = f"{int(time.time()):x}"  # distingue versões entre execuções
+_atualizar_config_publica()
+atexit.register(_gravar_pendente)
 
 # ─────────────────────────────────────────────
 #  CACHE DE STATUS DOS RADARES
 # ─────────────────────────────────────────────
 status_radares = {}   # radar_id -> {status, ultima_atualizacao, ...}
-eventos_recentes = [] # lista de detecções em tempo real
+eventos_recentes = deque(maxlen=200)  # pares (seq, evento) em tempo real (mais recente à esquerda)
+seen_uuids = OrderedDict()  # uuids já recebidos (LRU limitado)
 eventos_lock = threading.Lock()
+eventos_cv = threading.Condition(eventos_lock)  # acorda os streams SSE a cada evento
+_event_seq = 0        # sequência monotônica dos eventos (guardada ao lado de cada evento)
+
+
+status_versao = 0     # incrementado a cada mudança em status_radares
+
+
+def ttl_cache(seconds: float, cachear=lambda valor: True):
+    """Memoiza o resultado de uma função sem argumentos por `seconds` segundos.
+
+    Resultados para os quais `cachear(valor)` é falso não ficam guardados;
+    `funcao.cache_clear()` descarta o valor guardado.
+    """
+    def decorador(f):
+        lock = threading.Lock()
+        cache = {"valor": None, "expira": 0.0}
+
+        @wraps(f)
+        def wrapper():
+            with lock:
+                agora = time.monotonic()
+                if agora >= cache["expira"]:
+                    valor = f()
+                    if not cachear(valor):
+                        cache["expira"] = 0.0
+                        return valor
+                    cache["valor"] = valor
+                    cache["expira"] = agora + seconds
+                return cache["valor"]
+
+        def cache_clear():
+            with lock:
+                cache["valor"] = None
+                cache["expira"] = 0.0
+
+        wrapper.cache_clear = cache_clear
+        return wrapper
+    return decorador
 
 
 def atualizar_status_radar(radar_id: str, dados: dict):
+    global status_versao
     status_radares[radar_id] = {
         **dados,
         "ultima_atualizacao": datetime.now().isoformat()
     }
+    status_versao += 1
 
 
 def adicionar_evento(evento: dict):
+    global _event_seq
     with eventos_lock:
-        eventos_recentes.insert(0, evento)
-        if len(eventos_recentes) > 200:
-            eventos_recentes.pop()
+        _event_seq += 1
+        eventos_recentes.appendleft((_event_seq, evento))
+        ev_key = evento.get("uuid")
+        if ev_key:
+            seen_uuids[ev_key] = None
+            if len(seen_uuids) > 400:
+                seen_uuids.popitem(last=False)
+        eventos_cv.notify_all()
 
 
 # ─────────────────────────────────────────────
 #  COMUNICAÇÃO COM RADARES
 # ─────────────────────────────────────────────
-def chamar_radar(ip: str, endpoint: str, method: str = "GET", payload: dict = None):
-    """Faz requisição autenticada a um radar."""
+# Sessão compartilhada: reaproveita conexões TCP com os radares
+SESSION = requests.Session()
+SESSION.mount("http://", HTTPAdapter(pool_connections=64, pool_maxsize=64, max_retries=0))
+
+
+def atualizar_token_sessao():
+    """Aplica o token atual ao cabeçalho da sessão compartilhada."""
+    SESSION.headers["Authorization"] = f"Bearer {config['api_token']}"
+
+
+atualizar_token_sessao()
+
+
+def chamar_radar(ip: str, endpoint: str, method: str = "GET", payload: dict = None,
+                 raw_payload: bytes = None):
+    """Faz requisição autenticada a um radar.
+
+    raw_payload permite enviar um JSON já serializado (ex.: mesmo corpo para vários radares).
+    """
     url = f"http://{ip}:{RADAR_API_PORT}/api/{endpoint}"
-    headers = {"Authorization": f"Bearer {config['api_token']}"}
     try:
-        if method == "POST":
-            r = requests.post(url, json=payload, headers=headers, timeout=4)
+        if method == "POST" and raw_payload is not None:
+            r = SESSION.post(url, data=raw_payload, timeout=4,
+                             headers={"Content-Type": "application/json"})
+        elif method == "POST":
+            r = SESSION.post(url, json=payload, timeout=4)
         else:
-            r = requests.get(url, headers=headers, timeout=4)
+            r = SESSION.get(url, timeout=4)
         return r.json(), r.status_code
     except Exception as e:
         return {"erro": str(e)}, 0
 
 
-def descobrir_radar(ip: str) -> dict | None:
+async def descobrir_radar(session: aiohttp.ClientSession, ip: str) -> dict | None:
     """Tenta /api/ping em um IP para ver se é um radar."""
     try:
-        r = requests.get(
-            f"http://{ip}:{RADAR_API_PORT}/api/ping",
-            timeout=SCAN_TIMEOUT
-        )
-        if r.status_code == 200:
-            dados = r.json()
-            if dados.get("servico") == "radar":
-                return {"ip": ip, **dados}
+        async with session.get(f"http://{ip}:{RADAR_API_PORT}/api/ping") as r:
+            if r.status == 200:
+                dados = await r.json(content_type=None)
+                if dados.get("servico") == "radar":
+                    return {"ip": ip, **dados}
     except Exception:
         pass
     return None
 
 
-def escanear_rede(rede_cidr: str) -> list:
-    """Escaneia uma rede CIDR procurando radares."""
-    encontrados = []
-    lock = threading.Lock()
+def _ips_da_rede(rede):
+    """Gera os IPs de host da rede como strings, sem criar um IPv4Address por host."""
+    if rede.version != 4 or rede.num_addresses <= 2:
+        return (str(ip) for ip in rede.hosts())  # IPv6, /31 e /32
+    inicio = int(rede.network_address) + 1
+    fim = int(rede.broadcast_address)
+    return (socket.inet_ntoa(n.to_bytes(4, "big")) for n in range(inicio, fim))
 
-    def checar_ip(ip):
-        r = descobrir_radar(str(ip))
-        if r:
-            with lock:
-                encontrados.append(r)
-                # Registra radar conhecido
-                config["radares_conhecidos"][r["radar_id"]] = {
-                    "ip": str(ip),
-                    "radar_nome": r.get("radar_nome", ""),
-                    "descoberto_em": datetime.now().isoformat()
-                }
-                salvar_config(config)
 
+async def _escanear_hosts(rede) -> list:
+    """Consulta todos os hosts da rede com concorrência limitada."""
+    sem = asyncio.Semaphore(SCAN_CONCORRENCIA)
+    timeout = aiohttp.ClientTimeout(total=SCAN_TIMEOUT)
+
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        async def checar_ip(ip):
+            async with sem:
+                return await descobrir_radar(session, ip)
+
+        tasks = [asyncio.create_task(checar_ip(ip)) for ip in _ips_da_rede(rede)]
+        resultados = await asyncio.gather(*tasks)
+
+    return [r for r in resultados if r]
+
+
+def escanear_rede(rede_cidr: str) -> list:
+    """Escaneia uma rede CIDR procurando radares."""
     try:
         rede = ipaddress.ip_network(rede_cidr, strict=False)
-        threads = []
-        for ip in rede.hosts():
-            t = threading.Thread(target=checar_ip, args=(ip,))
-            t.daemon = True
-            threads.append(t)
-            t.start()
-            # Limita concorrência
-            if len([x for x in threads if x.is_alive()]) >= 50:
-                time.sleep(0.1)
-
-        for t in threads:
-            t.join(timeout=SCAN_TIMEOUT + 1)
-
     except ValueError as e:
         return [{"erro": str(e)}]
 
+    encontrados = asyncio.run(_escanear_hosts(rede))
+
+    # Registra radares conhecidos e grava o arquivo uma única vez
+    with _config_lock:
+        for r in encontrados:
+            config["radares_conhecidos"][r["radar_id"]] = {
+                "ip": r["ip"],
+                "radar_nome": r.get("radar_nome", ""),
+                "descoberto_em": datetime.now().isoformat()
+            }
+    if encontrados:
+        salvar_config_debounced()
+
     return encontrados
 
 
+_net_cache = {"value": None, "ts": 0.0}
+_net_cache_lock = threading.Lock()
+
+
 def detectar_rede_local() -> str:
-    """Detecta a rede local automaticamente."""
-    try:
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        s.connect(("8.8.8.8", 80))
-        ip_local = s.getsockname()[0]
-        s.close()
-        # Assume /24
-        partes = ip_local.split(".")
-        return f"{partes[0]}.{partes[1]}.{partes[2]}.0/24"
-    except Exception:
-        return "192.168.1.0/24"
+    """Detecta a rede local automaticamente (resultado reaproveitado por 60s)."""
+    with _net_cache_lock:
+        if _net_cache["value"] and time.monotonic() - _net_cache["ts"] < 60:
+            return _net_cache["value"]
+        try:
+            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            s.connect(("8.8.8.8", 80))
+            ip_local = s.getsockname()[0]
+            s.close()
+            # Assume /24
+            partes = ip_local.split(".")
+            rede = f"{partes[0]}.{partes[1]}.{partes[2]}.0/24"
+        except Exception:
+            # Não guarda o padrão: tenta detectar de novo na próxima chamada
+            return "192.168.1.0/24"
+        _net_cache["value"] = rede
+        _net_cache["ts"] = time.monotonic()
+        return rede
 
 
 # ─────────────────────────────────────────────
 #  POLLING EM TEMPO REAL
 # ─────────────────────────────────────────────
+versao_eventos = {}   # radar_id -> última events_version já buscada
+
+
+async def chamar_radar_async(session: aiohttp.ClientSession, ip: str, endpoint: str):
+    """Versão assíncrona (GET) de chamar_radar, usada pelo polling."""
+    url = f"http://{ip}:{RADAR_API_PORT}/api/{endpoint}"
+    headers = {"Authorization": f"Bearer {config['api_token']}"}
+    try:
+        async with session.get(url, headers=headers) as r:
+            return await r.json(content_type=None), r.status
+    except Exception as e:
+        return {"erro": str(e)}, 0
+
+
+async def poll_radar(session: aiohttp.ClientSession, radar_id: str, info: dict):
+    """Atualiza status e eventos de um radar."""
+    ip = info.get("ip")
+    if not ip:
+        return
+    status, code = await chamar_radar_async(session, ip, "status")
+    if code == 200:
+        status["ip"] = ip
+        status["online"] = True
+        atualizar_status_radar(radar_id, status)
+
+        # Busca eventos novos só quando a versão de eventos do radar avançou
+        versao = status.get("events_version")
+        anterior = versao_eventos.get(radar_id)
+        if versao is not None and versao == anterior:
+            return
+        endpoint = "eventos"
+        if versao is not None and anterior is not None and versao > anterior:
+            endpoint = f"eventos?since={anterior}"
+        evts, code2 = await chamar_radar_async(session, ip, endpoint)
+        if code2 == 200 and isinstance(evts, list):
+            versao_eventos[radar_id] = versao
+            for ev in evts[:5]:  # máximo 5 por polling
+                ev_key = ev.get("uuid", "")
+                if ev_key and ev_key not in seen_uuids:
+                    adicionar_evento(ev)
+    else:
+        atualizar_status_radar(radar_id, {
+            "ip": ip, "online": False,
+            "radar_id": radar_id,
+            "radar_nome": info.get("radar_nome", radar_id)
+        })
+
+
+async def loop_polling_async():
+    """Consulta todos os radares conhecidos em paralelo a cada 5s."""
+    connector = aiohttp.TCPConnector(limit=100, keepalive_timeout=30)
+    timeout = aiohttp.ClientTimeout(total=4)
+    snapshot, versao_snapshot = (), -1
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        while True:
+            # Só refaz a lista de radares quando a config mudou
+            if versao_snapshot != config_versao:
+                with _config_lock:
+                    snapshot = tuple(config["radares_conhecidos"].items())
+                    versao_snapshot = config_versao
+            await asyncio.gather(
+                *[poll_radar(session, rid, info) for rid, info in snapshot],
+                return_exceptions=True
+            )
+            await asyncio.sleep(5)
+
+
 def loop_polling():
     """Faz polling periódico em todos os radares conhecidos."""
-    while True:
-        for radar_id, info in list(config["radares_conhecidos"].items()):
-            ip = info.get("ip")
-            if not ip:
-                continue
-            try:
-                status, code = chamar_radar(ip, "status")
-                if code == 200:
-                    status["ip"] = ip
-                    status["online"] = True
-                    atualizar_status_radar(radar_id, status)
-
-                    # Busca eventos novos
-                    evts, code2 = chamar_radar(ip, "eventos")
-                    if code2 == 200 and isinstance(evts, list):
-                        for ev in evts[:5]:  # máximo 5 por polling
-                            ev_key = ev.get("uuid", "")
-                            if ev_key and not any(
-                                e.get("uuid") == ev_key for e in eventos_recentes[:50]
-                            ):
-                                adicionar_evento(ev)
-                else:
-                    atualizar_status_radar(radar_id, {
-                        "ip": ip, "online": False,
-                        "radar_id": radar_id,
-                        "radar_nome": info.get("radar_nome", radar_id)
-                    })
-            except Exception:
-                pass
-        time.sleep(5)
+    asyncio.run(loop_polling_async())
 
 
 # ─────────────────────────────────────────────
 #  POSTGRESQL CENTRAL
 # ─────────────────────────────────────────────
+_pg_pool = None
+_pg_pool_lock = threading.Lock()
+
+CAMPOS_PG = ("pg_host", "pg_port", "pg_db", "pg_user", "pg_pass")
+
+
+# Fechar conexões custa um round-trip; fica com uma thread fora da requisição
+_close_q = queue.Queue()
+
+
+def loop_fechamento_pg():
+    """Fecha em background os pools de PostgreSQL descartados."""
+    for pool in iter(_close_q.get, None):
+        try:
+            pool.closeall()
+        except Exception:
+            pass
+
+
+def reiniciar_pool_pg():
+    """Descarta o pool atual; o próximo get_pg() cria outro com a config nova."""
+    global _pg_pool
+    with _pg_pool_lock:
+        pool, _pg_pool = _pg_pool, None
+    if pool is not None:
+        _close_q.put(pool)
+
+
+@contextmanager
 def get_pg():
-    if not PG_AVAILABLE or not config.get("pg_host"):
-        return None
+    """Empresta uma conexão do pool (ou None se o PostgreSQL estiver indisponível)."""
+    global _pg_pool
+    pool = conn = None
+    if PG_AVAILABLE and config.get("pg_host"):
+        try:
+            with _pg_pool_lock:
+                if _pg_pool is None:
+                    _pg_pool = psycopg2.pool.ThreadedConnectionPool(
+                        1, 8,
+                        host=config["pg_host"], port=config["pg_port"],
+                        dbname=config["pg_db"], user=config["pg_user"],
+                        password=config["pg_pass"], connect_timeout=5
+                    )
+                pool = _pg_pool
+            conn = pool.getconn()
+        except Exception:
+            conn = None
     try:
-        return psycopg2.connect(
-            host=config["pg_host"], port=config["pg_port"],
-            dbname=config["pg_db"], user=config["pg_user"],
-            password=config["pg_pass"], connect_timeout=5
-        )
-    except Exception:
-        return None
+        yield conn
+    finally:
+        if conn is not None:
+            try:
+                if not conn.closed:
+                    conn.rollback()
+                # Conexões quebradas são descartadas em vez de voltar ao pool
+                pool.putconn(conn, close=bool(conn.closed))
+            except Exception:
+                pass
+
+
+SQL_ESTATISTICAS = """
+    WITH w AS MATERIALIZED (
+        SELECT radar_id, radar_nome, timestamp, velocidade, acima_limite
+        FROM radar_deteccoes
+        WHERE timestamp > NOW() - INTERVAL '24 hours'
+    )
+    SELECT json_build_object(
+        'hoje', (
+            SELECT json_build_object(
+                'total', COUNT(*),
+                'infrações', COUNT(*) FILTER (WHERE acima_limite),
+                'media_velocidade', AVG(velocidade),
+                'max_velocidade', MAX(velocidade),
+                'total_radares', COUNT(DISTINCT radar_id)
+            )
+            FROM w
+        ),
+        'por_radar', COALESCE((
+            SELECT json_agg(r)
+            FROM (
+                SELECT radar_id, radar_nome,
+                       COUNT(*) as deteccoes,
+                       AVG(velocidade) as media,
+                       MAX(velocidade) as maxima,
+                       COUNT(*) FILTER (WHERE acima_limite) as infracoes
+                FROM w
+                GROUP BY radar_id, radar_nome
+                ORDER BY deteccoes DESC
+            ) r
+        ), '[]'::json),
+        'por_hora', COALESCE((
+            SELECT json_agg(h)
+            FROM (
+                SELECT
+                    date_trunc('hour', timestamp) as hora,
+                    COUNT(*) as deteccoes,
+                    AVG(velocidade) as media
+                FROM w
+                GROUP BY hora
+                ORDER BY hora
+            ) h
+        ), '[]'::json)
+    )
+"""
 
 
+@ttl_cache(seconds=5, cachear=lambda r: r is not None and "erro" not in r)
 def pg_estatisticas():
-    """Busca estatísticas do banco central."""
-    pg = get_pg()
-    if not pg:
-        return None
-    try:
-        c = pg.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-
-        c.execute("""
-            SELECT
-                COUNT(*) as total,
-                COUNT(*) FILTER (WHERE acima_limite) as infrações,
-                AVG(velocidade) as media_velocidade,
-                MAX(velocidade) as max_velocidade,
-                COUNT(DISTINCT radar_id) as total_radares
-            FROM radar_deteccoes
-            WHERE timestamp > NOW() - INTERVAL '24 hours'
-        """)
-        hoje = dict(c.fetchone())
-
-        c.execute("""
-            SELECT radar_id, radar_nome,
-                   COUNT(*) as deteccoes,
-                   AVG(velocidade) as media,
-                   MAX(velocidade) as maxima,
-                   COUNT(*) FILTER (WHERE acima_limite) as infracoes
-            FROM radar_deteccoes
-            WHERE timestamp > NOW() - INTERVAL '24 hours'
-            GROUP BY radar_id, radar_nome
-            ORDER BY deteccoes DESC
-        """)
-        por_radar = [dict(r) for r in c.fetchall()]
-
-        c.execute("""
-            SELECT
-                date_trunc('hour', timestamp) as hora,
-                COUNT(*) as deteccoes,
-                AVG(velocidade) as media
-            FROM radar_deteccoes
-            WHERE timestamp > NOW() - INTERVAL '24 hours'
-            GROUP BY hora
-            ORDER BY hora
-        """)
-        por_hora = [dict(r) for r in c.fetchall()]
-        for r in por_hora:
-            if r.get("hora"):
-                r["hora"] = r["hora"].isoformat()
-
-        pg.close()
-        return {"hoje": hoje, "por_radar": por_radar, "por_hora": por_hora}
-    except Exception as e:
-        pg.close()
-        return {"erro": str(e)}
+    """Busca estatísticas do banco central (uma única leitura da janela de 24h)."""
+    with get_pg() as pg:
+        if not pg:
+            return None
+        try:
+            c = pg.cursor()
+            c.execute(SQL_ESTATISTICAS)
+            return c.fetchone()[0]
+        except Exception as e:
+            return {"erro": str(e)}
 
 
 # ─────────────────────────────────────────────
 #  FLASK — ROTAS DA API
 # ─────────────────────────────────────────────
+class OrjsonProvider(DefaultJSONProvider):
+    """Serialização JSON do Flask (jsonify) usando orjson."""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
 app = Flask(__name__, template_folder="templates", static_folder="static")
+app.json = OrjsonProvider(app)
 
 
 @app.route("/")
@@ -299,9 +546,11 @@ def index():
 
 @app.route("/api/config", methods=["GET"])
 def api_get_config():
-    cfg = dict(config)
-    cfg.pop("pg_pass", None)  # nunca envia a senha para o frontend
-    return jsonify(cfg)
+    # _config_public já vem sem pg_pass: nunca envia a senha para o frontend
+    versao, publica = _config_public
+    resp = jsonify(publica)
+    resp.set_etag(f"{_config_etag_base}-{versao}")
+    return resp.make_conditional(request)
 
 
 @app.route("/api/config", methods=["POST"])
@@ -312,10 +561,16 @@ def api_set_config():
         "api_token", "speed_limit", "sensor_dist_m",
         "sensor_a_pin", "sensor_b_pin", "sync_interval"
     ]
-    for campo in campos_permitidos:
-        if campo in dados:
-            config[campo] = dados[campo]
-    salvar_config(config)
+    with _config_lock:
+        for campo in campos_permitidos:
+            if campo in dados:
+                config[campo] = dados[campo]
+    salvar_config_debounced()
+    if "api_token" in dados:
+        atualizar_token_sessao()
+    if any(campo in dados for campo in CAMPOS_PG):
+        reiniciar_pool_pg()
+        pg_estatisticas.cache_clear()  # não serve números/erro do banco anterior
     return jsonify({"status": "ok"})
 
 
@@ -332,20 +587,33 @@ def api_escanear():
     return jsonify({"radares": radares, "total": len(radares)})
 
 
+_radares_cache = {"chave": None, "valor": []}
+_radares_cache_lock = threading.Lock()
+
+
 @app.route("/api/radares", methods=["GET"])
 def api_radares():
     """Lista todos os radares conhecidos com status."""
-    resultado = []
-    for radar_id, info in config["radares_conhecidos"].items():
-        status = status_radares.get(radar_id, {})
-        resultado.append({
-            "radar_id": radar_id,
-            "ip": info.get("ip"),
-            "radar_nome": info.get("radar_nome", radar_id),
-            "descoberto_em": info.get("descoberto_em"),
-            "online": status.get("online", False),
-            **status
-        })
+    with _radares_cache_lock:
+        # Só remonta a lista quando a config ou o status dos radares mudou
+        chave = (config_versao, status_versao)
+        if _radares_cache["chave"] != chave:
+            resultado = []
+            with _config_lock:
+                itens = list(config["radares_conhecidos"].items())
+            for radar_id, info in itens:
+                status = status_radares.get(radar_id, {})
+                resultado.append({
+                    "radar_id": radar_id,
+                    "ip": info.get("ip"),
+                    "radar_nome": info.get("radar_nome", radar_id),
+                    "descoberto_em": info.get("descoberto_em"),
+                    "online": status.get("online", False),
+                    **status
+                })
+            _radares_cache["chave"] = chave
+            _radares_cache["valor"] = resultado
+        resultado = _radares_cache["valor"]
     return jsonify(resultado)
 
 
@@ -405,17 +673,27 @@ def api_configurar_todos():
         **payload
     }
 
-    def enviar(rid, ip):
-        resp, code = chamar_radar(ip, "configurar", method="POST", payload=cfg_enviar)
-        resultados[rid] = {"status": code, "resposta": resp}
+    # Serializa uma vez só; o mesmo corpo vai para todos os radares
+    payload_bytes = orjson.dumps(cfg_enviar)
 
-    threads = []
-    for rid, info in config["radares_conhecidos"].items():
-        t = threading.Thread(target=enviar, args=(rid, info["ip"]))
-        threads.append(t)
-        t.start()
-    for t in threads:
-        t.join(timeout=6)
+    ex = ThreadPoolExecutor(max_workers=CONFIG_WORKERS)
+    futs = {
+        ex.submit(chamar_radar, info["ip"], "configurar", "POST",
+                  raw_payload=payload_bytes): rid
+        for rid, info in config["radares_conhecidos"].items()
+    }
+    try:
+        # Coleta na ordem em que os radares respondem, não na ordem de envio
+        for fut in as_completed(futs, timeout=6):
+            resp, code = fut.result()
+            resultados[futs[fut]] = {"status": code, "resposta": resp}
+    except FuturesTimeout:
+        for fut, rid in futs.items():
+            if rid not in resultados:
+                resultados[rid] = {"status": 0, "resposta": {"erro": "Tempo esgotado"}}
+    finally:
+        # Não espera os radares travados para responder
+        ex.shutdown(wait=False, cancel_futures=True)
 
     return jsonify(resultados)
 
@@ -431,37 +709,44 @@ def api_radar_reiniciar(radar_id):
 
 @app.route("/api/radares/<radar_id>/remover", methods=["DELETE"])
 def api_radar_remover(radar_id):
-    if radar_id in config["radares_conhecidos"]:
-        del config["radares_conhecidos"][radar_id]
-        salvar_config(config)
+    global status_versao
+    with _config_lock:
+        removido = config["radares_conhecidos"].pop(radar_id, None)
+    if removido is not None:
+        salvar_config_debounced()
     if radar_id in status_radares:
         del status_radares[radar_id]
+        status_versao += 1
     return jsonify({"status": "ok"})
 
 
 @app.route("/api/eventos", methods=["GET"])
 def api_eventos():
     with eventos_lock:
-        return jsonify(list(eventos_recentes[:50]))
+        return jsonify([ev for _, ev in islice(eventos_recentes, 50)])
 
 
 @app.route("/api/stream")
 def api_stream():
     """Server-Sent Events para atualizações em tempo real."""
     def gerar():
-        ultimo_tamanho = 0
+        ultimo_seq = 0
         while True:
-            with eventos_lock:
-                tamanho_atual = len(eventos_recentes)
-                if tamanho_atual > ultimo_tamanho:
-                    novos = eventos_recentes[:tamanho_atual - ultimo_tamanho]
-                    for ev in reversed(novos):
-                        yield f"data: {json.dumps(ev)}\n\n"
-                    ultimo_tamanho = tamanho_atual
-
-            # Envia heartbeat a cada 5s
-            yield f"event: heartbeat\ndata: {datetime.now().isoformat()}\n\n"
-            time.sleep(2)
+            novos = []
+            with eventos_cv:
+                # Bloqueia até chegar evento novo ou dar o tempo do heartbeat
+                eventos_cv.wait_for(lambda: _event_seq > ultimo_seq, timeout=15)
+                if _event_seq > ultimo_seq:
+                    # Mais recentes ficam à esquerda: pega até o último já enviado
+                    novos = [ev for _, ev in takewhile(lambda par: par[0] > ultimo_seq, eventos_recentes)]
+                    ultimo_seq = _event_seq
+
+            if novos:
+                for ev in reversed(novos):
+                    yield f"data: {orjson.dumps(ev).decode()}\n\n"
+            else:
+                # Heartbeat apenas quando não houve eventos em 15s
+                yield f"event: heartbeat\ndata: {datetime.now().isoformat()}\n\n"
 
     return Response(gerar(), mimetype="text/event-stream",
                     headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
@@ -469,10 +754,15 @@ def api_stream():
 
 @app.route("/api/pg/status", methods=["GET"])
 def api_pg_status():
-    pg = get_pg()
-    if not pg:
-        return jsonify({"conectado": False, "motivo": "Sem configuração ou falha de conexão"})
-    pg.close()
+    with get_pg() as pg:
+        if not pg:
+            return jsonify({"conectado": False, "motivo": "Sem configuração ou falha de conexão"})
+        try:
+            # getconn() não fala com o servidor: confere que a conexão do pool ainda responde
+            with pg.cursor() as cur:
+                cur.execute("SELECT 1")
+        except Exception as e:
+            return jsonify({"conectado": False, "motivo": str(e)})
     return jsonify({"conectado": True})
 
 
@@ -487,6 +777,30 @@ def api_pg_stats():
 # ─────────────────────────────────────────────
 #  MAIN
 # ─────────────────────────────────────────────
+_background_iniciado = False
+
+
+def iniciar_background():
+    """Inicia as threads de background (uma vez por processo).
+
+    Chamado pelo __main__ e pelo hook post_worker_init do gunicorn_conf.py.
+    """
+    global _background_iniciado
+    if _background_iniciado:
+        return
+    _background_iniciado = True
+
+    # Inicia gravação da config em background
+    threading.Thread(target=loop_gravacao_config, daemon=True).start()
+
+    # Inicia fechamento de conexões PG em background
+    threading.Thread(target=loop_fechamento_pg, daemon=True).start()
+
+    # Inicia polling em background
+    threading.Thread(target=loop_polling, daemon=True).start()
+    print("  Polling de radares iniciado (a cada 5s)")
+
+
 if __name__ == "__main__":
     print("=" * 55)
     print("  RADAR MANAGER — Sistema de Gerenciamento Central")
@@ -495,9 +809,7 @@ if __name__ == "__main__":
     print(f"  Config salva em: {CONFIG_FILE.absolute()}")
     print("=" * 55)
 
-    # Inicia polling em background
-    threading.Thread(target=loop_polling, daemon=True).start()
-    print("  Polling de radares iniciado (a cada 5s)")
+    iniciar_background()
 
     # Abre browser automaticamente no Windows
     try: